@@ -1,8 +1,14 @@
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
+import asyncio
 import joblib
 import json
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pyarrow import csv as pacsv
+import threading
 from pathlib import Path
 
 app = FastAPI(title="AQI Predictor API")
@@ -10,8 +16,14 @@ app = FastAPI(title="AQI Predictor API")
 BASE_DIR = Path(__file__).resolve().parents[1]
 MODEL_PATH = BASE_DIR / "model.pkl"
 FEATURES_JSON = BASE_DIR / "feature_columns.json"
+DATA_PARQUET = BASE_DIR / "features_data.parquet"
 DATA_CSV = BASE_DIR / "features_data.csv"
 
+# Concurrent /predict calls are coalesced into one model.predict of up to MAX_BATCH_SIZE rows,
+# waiting at most MAX_BATCH_DELAY_MS for the batch to fill
+MAX_BATCH_SIZE = 64
+MAX_BATCH_DELAY_MS = 5
+
 
 class PredictRequest(BaseModel):
     features: dict
@@ -20,7 +32,8 @@ class PredictRequest(BaseModel):
 def load_model_and_schema():
     if not MODEL_PATH.exists() or not FEATURES_JSON.exists():
         raise FileNotFoundError("Model or feature schema not found. Please run train.py to create 'model.pkl' and 'feature_columns.json'.")
-    model = joblib.load(MODEL_PATH)
+    # Memory-map the model's numpy arrays read-only so uvicorn worker processes share one copy in the page cache
+    model = joblib.load(MODEL_PATH, mmap_mode="r")
     with open(FEATURES_JSON, "r") as f:
         feature_cols = json.load(f)
     return model, feature_cols
@@ -28,6 +41,94 @@ def load_model_and_schema():
 
 model, feature_columns = load_model_and_schema()
 
+# Last row of the features file, keyed on its (path, mtime, size) so it is only re-read when it changes
+_latest_cache = {"key": None, "x": None, "index": None}
+_latest_lock = threading.Lock()
+
+
+def features_data_path():
+    """Return features_data.parquet written by train.py, else the features_data.csv sample, else None."""
+    for path in (DATA_PARQUET, DATA_CSV):
+        if path.exists():
+            return path
+    return None
+
+
+def read_feature_columns(path):
+    """Read only the model's feature columns from a features file (Parquet or CSV)."""
+    wanted = set(feature_columns)
+    if path.suffix == ".parquet":
+        present = [c for c in pq.read_schema(path).names if c in wanted]
+        return pd.read_parquet(path, columns=present)
+    with open(path, "r") as f:
+        header = f.readline().strip().split(",")
+    present = [c for c in header if c in wanted]
+    # Arrow's multithreaded reader with declared column types skips pandas' type inference
+    options = pacsv.ConvertOptions(column_types={c: pa.float64() for c in present}, include_columns=present)
+    return pacsv.read_csv(path, convert_options=options).to_pandas()
+
+
+def load_latest_features(path):
+    """Return the model input vector and index of the last row in `path`, or (None, None) if empty."""
+    stat = path.stat()
+    key = (str(path), stat.st_mtime_ns, stat.st_size)
+    with _latest_lock:
+        if _latest_cache["key"] != key:
+            df = read_feature_columns(path)
+            if df.empty:
+                x, index = None, None
+            else:
+                # Missing feature columns are passed as NaN (missing), as in training
+                x = df.iloc[-1].reindex(feature_columns).to_numpy(dtype=np.float64).reshape(1, -1)
+                index = int(df.index[-1])
+            _latest_cache.update(key=key, x=x, index=index)
+        return _latest_cache["x"], _latest_cache["index"]
+
+
+_batch_queue = None
+_batch_worker_task = None
+
+
+async def _batch_worker():
+    loop = asyncio.get_running_loop()
+    while True:
+        x, fut = await _batch_queue.get()
+        rows, futures = [x], [fut]
+        deadline = loop.time() + MAX_BATCH_DELAY_MS / 1000
+        while len(rows) < MAX_BATCH_SIZE:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                x, fut = await asyncio.wait_for(_batch_queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            rows.append(x)
+            futures.append(fut)
+        try:
+            # Run the prediction off the event loop so requests keep queueing meanwhile
+            preds = await loop.run_in_executor(None, model.predict, np.vstack(rows))
+        except Exception as e:
+            for f in futures:
+                if not f.done():
+                    f.set_exception(e)
+            continue
+        for f, p in zip(futures, preds):
+            if not f.done():
+                f.set_result(float(p))
+
+
+async def predict_batched(x):
+    """Queue a (1, n_features) row for the batch worker and wait for its prediction."""
+    global _batch_queue, _batch_worker_task
+    loop = asyncio.get_running_loop()
+    if _batch_worker_task is None or _batch_worker_task.done() or _batch_worker_task.get_loop() is not loop:
+        _batch_queue = asyncio.Queue()
+        _batch_worker_task = loop.create_task(_batch_worker())
+    fut = loop.create_future()
+    await _batch_queue.put((x, fut))
+    return await fut
+
 
 @app.get("/health")
 def health():
@@ -36,32 +137,24 @@ def health():
 
 @app.get("/predict/latest")
 def predict_latest():
-    if not DATA_CSV.exists():
-        raise HTTPException(status_code=404, detail="features_data.csv not found. Run data pipeline or training script first.")
-    df = pd.read_csv(DATA_CSV)
-    if df.empty:
-        raise HTTPException(status_code=400, detail="No data available in features_data.csv")
-    latest = df.iloc[-1]
-    # Build input vector in the required column order
-    x = []
-    for c in feature_columns:
-        x.append(float(latest.get(c, 0)))
-    pred = model.predict([x])[0]
-    return {"prediction": float(pred), "index": int(df.index[-1])}
+    path = features_data_path()
+    if path is None:
+        raise HTTPException(status_code=404, detail="features_data.parquet / features_data.csv not found. Run data pipeline or training script first.")
+    x, index = load_latest_features(path)
+    if x is None:
+        raise HTTPException(status_code=400, detail=f"No data available in {path.name}")
+    pred = model.predict(x)[0]
+    return {"prediction": float(pred), "index": index}
 
 
 @app.post("/predict")
-def predict(payload: PredictRequest):
-    incoming = payload.features
-    x = []
-    for c in feature_columns:
-        try:
-            val = incoming.get(c, 0)
-            x.append(float(val))
-        except Exception:
-            x.append(0.0)
-    pred = model.predict([x])[0]
-    return {"prediction": float(pred)}
+async def predict(payload: PredictRequest):
+    # Unknown keys are ignored; missing, null or non-numeric features become NaN, which the
+    # model was trained to treat as missing (train.py keeps NaNs instead of filling them)
+    incoming = pd.Series(payload.features, dtype=object).reindex(feature_columns)
+    x = pd.to_numeric(incoming, errors="coerce").to_numpy(dtype=np.float64).reshape(1, -1)
+    pred = await predict_batched(x)
+    return {"prediction": pred}
 
 
 if __name__ == "__main__":
@@ -1,5 +1,8 @@
 import streamlit as st
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+from pyarrow import csv as pacsv
 import joblib
 import json
 from pathlib import Path
@@ -7,6 +10,8 @@ from pathlib import Path
 BASE_DIR = Path(__file__).resolve().parents[1]
 MODEL_PATH = BASE_DIR / "model.pkl"
 FEATURES_JSON = BASE_DIR / "feature_columns.json"
+IMPORTANCES_JSON = BASE_DIR / "feature_importances.json"
+DATA_PARQUET = BASE_DIR / "features_data.parquet"
 DATA_CSV = BASE_DIR / "features_data.csv"
 
 
@@ -18,24 +23,63 @@ def load_model():
     return model, feature_cols
 
 
-def main():
-    st.title("AQI Predictor — Dashboard")
+@st.cache_data
+def load_importances(path, mtime_ns):
+    """Permutation importances saved by train.py, for models without `feature_importances_`."""
+    with open(path, "r") as f:
+        return pd.Series(json.load(f), dtype=np.float64)
 
-    if not DATA_CSV.exists() or not MODEL_PATH.exists() or not FEATURES_JSON.exists():
-        st.warning("Missing artifacts. Please run `train.py` first to generate model and feature files.")
-        return
 
-    model, feature_cols = load_model()
+@st.cache_resource(ttl=12 * 3600)
+def get_feature_store():
+    """Log in to Hopsworks once and share the feature store handle across reruns and sessions."""
+    import hopsworks
+    project = hopsworks.login()
+    return project.get_feature_store()
 
-    df = pd.read_csv(DATA_CSV)
+
+@st.cache_data(ttl=300)
+def load_data(path, mtime_ns, feature_cols):
+    """Read, parse and sort the features file once per file version; `mtime_ns` is only part of the cache key."""
+    if path.suffix == ".parquet":
+        df = pd.read_parquet(path)
+    else:
+        # Declare the model features up front so Arrow's multithreaded reader skips type inference for them
+        options = pacsv.ConvertOptions(column_types={c: pa.float64() for c in feature_cols})
+        df = pacsv.read_csv(path, convert_options=options).to_pandas()
     # Try to parse timestamp for plotting if present
     if "timestamp" in df.columns:
         try:
-            df["timestamp"] = pd.to_datetime(df["timestamp"])
-            df = df.sort_values("timestamp")
-            df = df.reset_index(drop=True)
+            df["timestamp"] = pd.to_datetime(df["timestamp"], format="ISO8601")
+            # train.py writes the file in time order, so the sort is usually skipped
+            if not df["timestamp"].is_monotonic_increasing:
+                df = df.sort_values("timestamp", kind="mergesort")
+                df = df.reset_index(drop=True)
         except Exception:
             pass
+    return df
+
+
+@st.cache_data
+def predict_rows(_model, _df, data_key, feature_cols):
+    """Predict every row of the features file in one batched call, cached per file version (`data_key`)."""
+    # Missing feature columns are passed as NaN (missing), as in training
+    X = _df.reindex(columns=list(feature_cols)).to_numpy(dtype=np.float64)
+    return _model.predict(X)
+
+
+def main():
+    st.title("AQI Predictor — Dashboard")
+
+    # Prefer the Parquet copy written by train.py, fall back to the CSV sample
+    data_path = DATA_PARQUET if DATA_PARQUET.exists() else DATA_CSV
+    if not data_path.exists() or not MODEL_PATH.exists() or not FEATURES_JSON.exists():
+        st.warning("Missing artifacts. Please run `train.py` first to generate model and feature files.")
+        return
+
+    model, feature_cols = load_model()
+
+    df = load_data(data_path, data_path.stat().st_mtime_ns, tuple(feature_cols))
     st.subheader("Recent feature rows")
     st.dataframe(df.tail(10))
 
@@ -44,12 +88,12 @@ def main():
     st.header("Visualizations")
     available_features = [c for c in feature_cols if c in df.columns]
     if not available_features:
-        st.info("No features available for plotting. Make sure `feature_columns.json` matches `features_data.csv`.")
+        st.info("No features available for plotting. Make sure `feature_columns.json` matches the features data file.")
     else:
         default_selection = [f for f in ["pm2_5", "pm10", "aqi"] if f in available_features][:3]
         to_plot = st.multiselect("Select features to plot (time-series)", options=available_features, default=default_selection)
         if to_plot:
-            plot_df = df[to_plot].copy()
+            plot_df = df[to_plot]
             # If timestamp exists, set it as index for nicer x-axis
             if "timestamp" in df.columns:
                 plot_df.index = df["timestamp"]
@@ -58,7 +102,7 @@ def main():
         # If AQI exists, show predicted vs actual for the test portion (quick view)
         if "aqi" in df.columns:
             st.subheader("AQI: actual (from data) — quick view")
-            aqi_plot = df[["aqi"]].copy()
+            aqi_plot = df[["aqi"]]
             if "timestamp" in df.columns:
                 aqi_plot.index = df["timestamp"]
             st.line_chart(aqi_plot.tail(500))
@@ -67,35 +111,34 @@ def main():
     st.markdown("---")
     st.header("Model feature importances")
     try:
-        import numpy as _np
+        importances = None
         if hasattr(model, "feature_importances_"):
-            importances = model.feature_importances_
-            imp_map = {c: float(im) for c, im in zip(feature_cols, importances)}
+            importances = pd.Series(model.feature_importances_, index=feature_cols)
+        elif IMPORTANCES_JSON.exists():
+            importances = load_importances(IMPORTANCES_JSON, IMPORTANCES_JSON.stat().st_mtime_ns)
+        if importances is not None:
             # Keep only those present in the dataset
-            imp_map = {k: v for k, v in imp_map.items() if k in df.columns}
-            if imp_map:
-                imp_df = pd.DataFrame.from_dict(imp_map, orient="index", columns=["importance"]).sort_values("importance", ascending=False)
+            importances = importances[importances.index.isin(df.columns)]
+            if not importances.empty:
+                imp_df = importances.sort_values(ascending=False).to_frame("importance")
                 st.bar_chart(imp_df)
             else:
                 st.info("No overlapping features between model and dataset for importances.")
         else:
-            st.info("Model does not expose feature_importances_.")
+            st.info("Model does not expose feature_importances_ and `feature_importances.json` was not found. Re-run `train.py` to generate it.")
     except Exception as e:
         st.warning(f"Could not compute feature importances: {e}")
 
     st.subheader("Prediction for latest row")
-    latest = df.iloc[-1]
-    x = [float(latest.get(c, 0)) for c in feature_cols]
-    pred = model.predict([x])[0]
-    st.metric(label="Predicted AQI (next hour)", value=round(float(pred), 2))
+    # One predict call covers the latest row and any row picked below
+    preds = predict_rows(model, df, (str(data_path), data_path.stat().st_mtime_ns), tuple(feature_cols))
+    st.metric(label="Predicted AQI (next hour)", value=round(float(preds[-1]), 2))
 
     st.subheader("Select a row to predict")
     idx = st.number_input("Row index (0-based)", min_value=0, max_value=len(df)-1, value=len(df)-1)
     selected = df.iloc[int(idx)]
     st.write(selected)
-    x_sel = [float(selected.get(c, 0)) for c in feature_cols]
-    pred_sel = model.predict([x_sel])[0]
-    st.metric(label=f"Prediction for row {idx}", value=round(float(pred_sel), 2))
+    st.metric(label=f"Prediction for row {idx}", value=round(float(preds[int(idx)]), 2))
 
     st.caption("This dashboard loads a saved model (`model.pkl`) and `feature_columns.json` created by `train.py`.")
 
@@ -107,17 +150,19 @@ def main():
     latest_row = None
     if use_feature_store:
         try:
-            import hopsworks
-            project = hopsworks.login()
-            fs = project.get_feature_store()
-            # attempt version 2 then 1 to be resilient
+            fs = get_feature_store()
+            # List all versions in one call and take the newest; probe version 2 then 1 if listing fails
             fg = None
-            for v in (2, 1):
-                try:
-                    fg = fs.get_feature_group("karachi_air_quality_features", version=v)
-                    break
-                except Exception:
-                    fg = None
+            try:
+                groups = fs.get_feature_groups("karachi_air_quality_features")
+                fg = max(groups, key=lambda g: g.version) if groups else None
+            except Exception:
+                for v in (2, 1):
+                    try:
+                        fg = fs.get_feature_group("karachi_air_quality_features", version=v)
+                        break
+                    except Exception:
+                        fg = None
             if fg is None:
                 st.warning("No feature group 'karachi_air_quality_features' found in Feature Store. Falling back to local CSV.")
             else:
@@ -134,12 +179,13 @@ def main():
         latest_row = df.iloc[-1]
 
     st.subheader("Current feature values (all)")
-    # Display only the features used by the model in order
-    feature_display = {c: float(latest_row.get(c, 0)) for c in feature_cols}
+    # Display only the features used by the model in order, exactly as the prediction below sends
+    # them; features missing from the row are sent as NaN and shown as null
+    x_curr = [float(latest_row.get(c, np.nan)) for c in feature_cols]
+    feature_display = {c: None if np.isnan(v) else v for c, v in zip(feature_cols, x_curr)}
     st.json(feature_display)
 
     if st.button("Predict current AQI"):
-        x_curr = [float(latest_row.get(c, 0)) for c in feature_cols]
         pred_curr = model.predict([x_curr])[0]
         st.success(f"Predicted current AQI (next hour): {round(float(pred_curr),2)}")
         # Show timestamp if available
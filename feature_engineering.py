@@ -1,11 +1,49 @@
-import hopsworks
 import pandas as pd
 import numpy as np
 import warnings
+from feature_store_utils import get_feature_store, insert_in_chunks, read_feature_group_cached
 
 # Suppress warnings from Hopsworks
 warnings.filterwarnings("ignore", category=UserWarning, module='hopsworks')
 
+def _prefix_sums(values):
+    """
+    Column-wise prefix sums of `values` and of its squares, for O(1)-per-row window sums.
+
+    Sums are taken in float64 after subtracting the first row, which keeps the
+    E[x^2] - E[x]^2 variance below numerically stable (the variance is shift-invariant).
+    """
+    offset = values[:1].astype(np.float64)
+    centered = values.astype(np.float64) - offset
+    s1 = np.zeros((len(values) + 1, values.shape[1]))
+    s2 = np.zeros_like(s1)
+    np.cumsum(centered, axis=0, out=s1[1:])
+    np.cumsum(centered * centered, axis=0, out=s2[1:])
+    return s1, s2, offset
+
+
+def _lagged_rolling_mean_std(sums, window, dtype):
+    """
+    Rolling mean and sample std (ddof=1) over `window` rows, from _prefix_sums() output.
+
+    Windows end one row back, matching `shift(1).rolling(window)`, so a row never sees its
+    own value; the first `window` rows are NaN.
+    """
+    s1, s2, offset = sums
+    n = len(s1) - 1
+    mean = np.full((n, s1.shape[1]), np.nan, dtype=dtype)
+    std = np.full_like(mean, np.nan)
+    if n > window:
+        # Row i of these is the window of rows [i, i + window)
+        win_sum = s1[window:] - s1[:-window]
+        win_sq = s2[window:] - s2[:-window]
+        win_mean = win_sum / window
+        var = np.maximum((win_sq - win_sum * win_mean) / (window - 1), 0)
+        mean[window:] = (win_mean + offset)[:-1]
+        std[window:] = np.sqrt(var)[:-1]
+    return mean, std
+
+
 def engineer_features(df_raw: pd.DataFrame) -> pd.DataFrame:
     """
     Engineers new features from the raw air quality dataframe.
@@ -20,9 +58,15 @@ def engineer_features(df_raw: pd.DataFrame) -> pd.DataFrame:
     print("Starting feature engineering...")
     
     # 1. Ensure correct data types and sorting
-    df = df_raw.copy()
-    df['timestamp'] = pd.to_datetime(df['timestamp'])
-    df = df.sort_values(by='timestamp').reset_index(drop=True)
+    # A shallow copy is enough: columns are only replaced, never written in place, so df_raw
+    # is left untouched.
+    df = df_raw.copy(deep=False)
+    # An explicit format keeps string timestamps on pandas' ISO8601 fast path; datetimes pass through
+    df['timestamp'] = pd.to_datetime(df['timestamp'], format='ISO8601')
+    # The O(n) monotonicity check skips the O(n log n) sort and its full copy when the rows
+    # already arrive in time order. No reset_index() needed: the index is rebuilt below.
+    if not df['timestamp'].is_monotonic_increasing:
+        df = df.sort_values(by='timestamp', kind='mergesort')
 
     # --- IMPUTATION STEP ---
     print("Handling missing values using time-series interpolation...")
@@ -38,53 +82,77 @@ def engineer_features(df_raw: pd.DataFrame) -> pd.DataFrame:
             
     df = df.ffill().bfill() 
     df = df.reset_index()
+
+    # Work in float32 from here on: lag/rolling passes are memory-bound, so half the bytes is
+    # roughly half the time. 'aqi' is left alone, it is cast back to int64 below.
+    float_cols = [col for col in pollutant_cols if col != 'aqi']
+    df[float_cols] = df[float_cols].astype(np.float32)
     # --- END IMPUTATION STEP ---
 
+    # New columns are collected here and joined onto df in one go (step 7). Assigning ~70
+    # columns one by one makes pandas re-consolidate its blocks and fragments the frame.
+    new_cols = {}
+
     # 2. Create cyclical time features
     print("Creating cyclical time features...")
-    df['hour'] = df['timestamp'].dt.hour
-    df['day_of_week'] = df['timestamp'].dt.dayofweek
-    df['month'] = df['timestamp'].dt.month
-    
-    df['hour_sin'] = np.sin(2 * np.pi * df['hour'] / 24)
-    df['hour_cos'] = np.cos(2 * np.pi * df['hour'] / 24)
-    df['day_of_week_sin'] = np.sin(2 * np.pi * df['day_of_week'] / 7)
-    df['day_of_week_cos'] = np.cos(2 * np.pi * df['day_of_week'] / 7)
-    df['month_sin'] = np.sin(2 * np.pi * df['month'] / 12)
-    df['month_cos'] = np.cos(2 * np.pi * df['month'] / 12)
-    
-    df = df.drop(columns=['hour', 'day_of_week', 'month'])
+    ts = df['timestamp'].dt
+    cycles = [('hour', ts.hour, 24), ('day_of_week', ts.dayofweek, 7), ('month', ts.month, 12)]
+
+    for name, values, period in cycles:
+        # One angle array per cycle, shared by sin and cos
+        theta = values.to_numpy(dtype=np.float32) * np.float32(2 * np.pi / period)
+        new_cols[f'{name}_sin'] = np.sin(theta)
+        new_cols[f'{name}_cos'] = np.cos(theta)
     
     # 3. Create Lag Features
     print("Creating lag features...")
     pollutants = ['pm2_5', 'pm10', 'co', 'o3', 'no2', 'so2']
     lags = [1, 3, 24] 
+    # All pollutants are processed together as one (rows, pollutants) array
+    values = df[pollutants].to_numpy(dtype=np.float32)
+
+    lagged = {}
+    for lag in lags:
+        lagged[lag] = np.full_like(values, np.nan)
+        lagged[lag][lag:] = values[:-lag]
 
-    for col in pollutants:
+    for j, col in enumerate(pollutants):
         for lag in lags:
-            df[f'{col}_lag_{lag}h'] = df[col].shift(lag)
+            new_cols[f'{col}_lag_{lag}h'] = lagged[lag][:, j]
             
     # 4. Create Rolling Window Features
     print("Creating rolling window features...")
     windows = [3, 12, 24] 
+    # Prefix sums are shared by every window size
+    sums = _prefix_sums(values)
 
-    for col in pollutants:
+    roll_avg, roll_std = {}, {}
+    for window in windows:
+        roll_avg[window], roll_std[window] = _lagged_rolling_mean_std(sums, window, values.dtype)
+
+    for j, col in enumerate(pollutants):
         for window in windows:
-            df[f'{col}_roll_avg_{window}h'] = df[col].shift(1).rolling(window=window).mean()
-            df[f'{col}_roll_std_{window}h'] = df[col].shift(1).rolling(window=window).std()
+            new_cols[f'{col}_roll_avg_{window}h'] = roll_avg[window][:, j]
+            new_cols[f'{col}_roll_std_{window}h'] = roll_std[window][:, j]
 
     # 5. Create Interaction Features
     print("Creating interaction features...")
-    df['no_x'] = df['no'] + df['no2']
-    df['pm2_5_to_pm10_ratio'] = df['pm2_5'] / (df['pm10'] + 1e-6)
+    # Both features are written straight into one preallocated float32 block, with no pandas temporaries
+    interactions = np.empty((len(df), 2), dtype=np.float32)
+    np.add(df['no'].to_numpy(), df['no2'].to_numpy(), out=interactions[:, 0])
+    np.add(df['pm10'].to_numpy(), np.float32(1e-6), out=interactions[:, 1])
+    np.divide(df['pm2_5'].to_numpy(), interactions[:, 1], out=interactions[:, 1])
+    new_cols['no_x'] = interactions[:, 0]
+    new_cols['pm2_5_to_pm10_ratio'] = interactions[:, 1]
     
     # 6. Create Target Variables
     print("Creating target variables...")
-    df['pm2_5_target_1h'] = df['pm2_5'].shift(-1) 
-    df['pm2_5_target_6h'] = df['pm2_5'].shift(-6) 
-    df['aqi_target_1h'] = df['aqi'].shift(-1)     
+    new_cols['pm2_5_target_1h'] = df['pm2_5'].shift(-1) 
+    new_cols['pm2_5_target_6h'] = df['pm2_5'].shift(-6) 
+    new_cols['aqi_target_1h'] = df['aqi'].shift(-1)     
     
     # 7. Clean up
+    df = pd.concat([df, pd.DataFrame(new_cols, index=df.index)], axis=1)
     print(f"Original shape: {df_raw.shape}") # Use df_raw.shape for original
     df = df.dropna()
     print(f"Shape after dropping NaNs: {df.shape}")
@@ -100,10 +168,11 @@ def engineer_features(df_raw: pd.DataFrame) -> pd.DataFrame:
     df['aqi'] = df['aqi'].astype(np.int64)
     # -------------------------------------------------------------
 
-    # Ensure all data is float for the feature store, except for our keys/int
-    for col in df.columns:
-        if col not in ['timestamp', 'timestamp_seconds', 'aqi']:
-            df[col] = df[col].astype(float)
+    # Ensure all data is float for the feature store, except for our keys/int.
+    # Features are upcast back to float64 here because version 2 of the feature group stores them as double.
+    # Cast as one block and rejoin, rather than column by column, so the result stays consolidated
+    feature_cols = [col for col in df.columns if col not in ['timestamp', 'timestamp_seconds', 'aqi']]
+    df = pd.concat([df.drop(columns=feature_cols), df[feature_cols].astype(float)], axis=1)[df.columns]
             
     print("Feature engineering complete.")
     return df
@@ -134,8 +203,7 @@ def main():
     """
     try:
         # 1. Connect to Hopsworks
-        project = hopsworks.login()
-        fs = project.get_feature_store()
+        project, fs = get_feature_store()
         
         # 2. Get the raw data Feature Group
         try:
@@ -150,7 +218,7 @@ def main():
             return
 
         # 3. Read data into a pandas DataFrame
-        df_raw = fg_raw.read()
+        df_raw = read_feature_group_cached(fg_raw)
         
         if df_raw.empty:
             print("Raw data is empty. Exiting.")
@@ -179,10 +247,7 @@ def main():
         
         print("Inserting engineered data into 'karachi_air_quality_features:2'...")
         # 6. Insert the new features
-        fg_engineered.insert(
-            df_features,
-            write_options={"wait_for_job": True} 
-        )
+        insert_in_chunks(fg_engineered, df_features)
         print("Successfully inserted engineered features.")
         
         # 7. Add descriptions
@@ -0,0 +1,167 @@
+"""Hopsworks Feature Store helpers shared by the ingestion, feature engineering and training scripts."""
+import functools
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+import pandas as pd
+import pyarrow.parquet as pq
+
+# Rows per insert call; keeps each client-side serialization and Kafka batch bounded
+INSERT_CHUNK_ROWS = 5000
+
+# Local Parquet copies of feature group reads, see read_feature_group_cached()
+CACHE_DIR = Path(__file__).resolve().parent / ".cache"
+
+# A cached Hopsworks login is reused for this many hours before logging in again
+LOGIN_TTL = float(os.getenv("HOPSWORKS_LOGIN_TTL_HOURS", "12")) * 3600
+_login_time = None
+
+
+@functools.lru_cache(maxsize=1)
+def _login():
+    global _login_time
+    import hopsworks
+    project = hopsworks.login()
+    _login_time = time.time()
+    return project, project.get_feature_store()
+
+
+def get_feature_store():
+    """
+    Returns the (project, feature_store) pair, logging in to Hopsworks only once per process.
+
+    The login is refreshed after HOPSWORKS_LOGIN_TTL_HOURS (default 12) so long-running
+    processes do not hold on to an expired session. Errors from hopsworks.login() propagate.
+    """
+    if _login_time is not None and time.time() - _login_time > LOGIN_TTL:
+        _login.cache_clear()
+    return _login()
+
+
+def get_latest_feature_group(fs, name, fallback_versions=(2, 1)):
+    """
+    Returns the highest version of feature group `name`, or None if it cannot be found.
+
+    All versions are listed in a single metadata call. If that call is unavailable or fails,
+    `fallback_versions` are probed one by one instead, in order.
+    """
+    try:
+        groups = fs.get_feature_groups(name)
+        if groups:
+            return max(groups, key=lambda fg: fg.version)
+    except Exception:
+        pass
+    for v in fallback_versions:
+        try:
+            return fs.get_feature_group(name, version=v)
+        except Exception:
+            continue
+    return None
+
+
+def insert_in_chunks(feature_group, df, chunk_rows=INSERT_CHUNK_ROWS):
+    """
+    Inserts a DataFrame into a feature group in chunks of `chunk_rows` rows.
+
+    Only the last chunk starts the offline materialization job (which then picks up
+    every chunk written before it) and waits for it, so a large backfill runs one job
+    instead of one per insert.
+
+    Args:
+        feature_group: The Hopsworks feature group to insert into.
+        df: The pandas DataFrame to insert.
+        chunk_rows: Maximum number of rows per insert call.
+    """
+    starts = list(range(0, len(df), chunk_rows)) or [0]
+    for begin in starts:
+        is_last = begin == starts[-1]
+        end = min(begin + chunk_rows, len(df))
+        print(f"  Inserting rows {begin}-{end} of {len(df)}...")
+        feature_group.insert(
+            df.iloc[begin:end],
+            write_options={"start_offline_materialization": is_last, "wait_for_job": is_last},
+        )
+
+
+def _latest_commit_id(feature_group):
+    """Returns the id of the feature group's most recent commit, or None if it has no commit history."""
+    try:
+        details = feature_group.commit_details(limit=1)
+    except Exception:
+        return None
+    return max(details) if details else None
+
+
+def project_columns(columns, available):
+    """Returns the entries of `columns` present in `available`, in `available` order; None means all."""
+    if columns is None:
+        return None
+    wanted = set(columns)
+    return [c for c in available if c in wanted]
+
+
+def read_feature_group_cached(feature_group, columns=None):
+    """
+    Reads a feature group, reusing a local Parquet copy while the group has no new commits.
+
+    The copy is stored as `.cache/{name}_v{version}_{commit_id}[_{columns hash}].parquet`, so
+    any new commit changes the file name and forces a fresh read. Delete the file to invalidate
+    it by hand. Feature groups without commit history are always read from the Feature Store.
+
+    Args:
+        feature_group: The Hopsworks feature group to read.
+        columns: Optional list of columns to read; the projection is pushed down into the
+            Feature Store query. Names the feature group does not have are ignored.
+
+    Returns:
+        A pandas DataFrame with the feature group's data.
+    """
+    names = project_columns(columns, [f.name for f in feature_group.features]) if columns is not None else None
+
+    def fetch():
+        return feature_group.read() if names is None else feature_group.select(names).read()
+
+    commit_id = _latest_commit_id(feature_group)
+    if commit_id is None:
+        return fetch()
+
+    prefix = f"{feature_group.name}_v{feature_group.version}_"
+    tag = "" if names is None else "_" + hashlib.sha1(",".join(names).encode()).hexdigest()[:8]
+    path = CACHE_DIR / f"{prefix}{commit_id}{tag}.parquet"
+    if path.exists():
+        print(f"Loaded '{feature_group.name}' version {feature_group.version} from local cache {path}.")
+        df = pd.read_parquet(path)
+    else:
+        df = fetch()
+        CACHE_DIR.mkdir(exist_ok=True)
+        for stale in CACHE_DIR.glob(f"{prefix}*.parquet"):
+            stale.unlink()
+        df.to_parquet(path, compression="zstd", index=False)
+
+    # The copy has just been checked against the Feature Store; see read_recent_cache()
+    manifest = {"version": feature_group.version, "path": path.name, "columns": columns, "checked_at": time.time()}
+    (CACHE_DIR / f"{feature_group.name}.manifest.json").write_text(json.dumps(manifest))
+    return df
+
+
+def read_recent_cache(name, max_age_seconds, columns=None):
+    """
+    Returns the cached copy of feature group `name` if it was checked against the Feature Store
+    within the last `max_age_seconds`, without contacting Hopsworks at all. Returns None otherwise,
+    or if the copy was read with a projection that does not cover `columns`.
+    """
+    manifest_path = CACHE_DIR / f"{name}.manifest.json"
+    try:
+        manifest = json.loads(manifest_path.read_text())
+    except (FileNotFoundError, ValueError):
+        return None
+    path = CACHE_DIR / manifest["path"]
+    if time.time() - manifest["checked_at"] > max_age_seconds or not path.exists():
+        return None
+    cached_columns = manifest.get("columns")
+    if cached_columns is not None and (columns is None or not set(columns) <= set(cached_columns)):
+        return None
+    print(f"Loaded '{name}' version {manifest['version']} from local cache {path} (checked less than {max_age_seconds}s ago).")
+    return pd.read_parquet(path, engine="pyarrow", columns=project_columns(columns, pq.read_schema(path).names))
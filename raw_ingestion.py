@@ -1,102 +1,200 @@
-import requests
+import asyncio
+import json
+import aiohttp
+import numpy as np
 import pandas as pd
-import hopsworks
-import time, datetime, os
+import time, os
+from pathlib import Path
 from dotenv import load_dotenv
+from feature_store_utils import get_feature_store, insert_in_chunks
 
-# --- Setup ---
-load_dotenv()
-project = hopsworks.login(api_key_value=os.getenv("HOPSWORKS_API_KEY"))
-fs = project.get_feature_store()
+# orjson's SIMD parser is several times faster than json on the 8k-record history payload.
+# Its JSONDecodeError subclasses json.JSONDecodeError, so error handling is the same.
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    json_loads = json.loads
 
 # --- API Parameters ---
 lat, lon = 24.8607, 67.0011  # Karachi
-API_KEY = os.getenv("OPENWEATHER_API_KEY")
-
-# Check if API keys are loaded
-if not API_KEY:
-    print("Error: OPENWEATHER_API_KEY not found. Please check your .env file.")
-    exit()
-if not os.getenv("HOPSWORKS_API_KEY"):
-    print("Error: HOPSWORKS_API_KEY not found. Please check your .env file.")
-    exit()
-
-end = int(time.time())
-start = end - 365 * 24 * 60 * 60  # last 730 days
-
-url = f"http://api.openweathermap.org/data/2.5/air_pollution/history?lat={lat}&lon={lon}&start={start}&end={end}&appid={API_KEY}"
-
-# --- Fetch Data ---
-print("Fetching air quality data from OpenWeather API...")
-print(f"Requesting URL: {url.replace(API_KEY, '***YOUR_API_KEY***')}") # Hide key in log
-res = requests.get(url)
-
-# -------------------- CRITICAL ERROR HANDLING --------------------
-# Check if the request was successful (HTTP 200)
-# If not, the response is NOT JSON and will cause the error you see.
-if res.status_code != 200:
-    print(f"Error: API request failed with status code {res.status_code}")
-    print("This is NOT a JSON response. The server returned:")
-    print(f"Response text: {res.text}")
-    print("\nPlease check your OPENWEATHER_API_KEY in the .env file.")
-    exit()  # Stop the script
-# -------------------- END ERROR HANDLING --------------------
-
-# Now it's safe to try parsing the JSON
-try:
-    data = res.json()
-except requests.exceptions.JSONDecodeError:
-    print("Error: The server returned a 200 OK status, but the response was NOT valid JSON.")
-    print(f"Response text: {res.text}")
-    exit()
-
-if "list" not in data:
-    print(f"Error: 'list' key not in API response. Response was: {data}")
-    exit()
-
-records = []
-for item in data["list"]:
-    records.append({
-        "timestamp": datetime.datetime.utcfromtimestamp(item["dt"]),
-        "aqi": item.get("main", {}).get("aqi"),
-        "co": item.get("components", {}).get("co"),
-        "no": item.get("components", {}).get("no"),
-        "no2": item.get("components", {}).get("no2"),
-        "o3": item.get("components", {}).get("o3"),
-        "so2": item.get("components", {}).get("so2"),
-        "pm2_5": item.get("components", {}).get("pm2_5"),
-        "pm10": item.get("components", {}).get("pm10"),
-        "nh3": item.get("components", {}).get("nh3")
-    })
-
-df = pd.DataFrame(records)
-df = df.sort_values("timestamp").reset_index(drop=True)
-
-if df.empty:
-    print("No records fetched. Exiting.")
-    exit()
-
-print(f"Fetched {len(df)} raw records.")
-
-# --- Fix 'aqi' column type for Hopsworks ---
-print("Fixing 'aqi' column type to match feature group schema...")
-if df['aqi'].isnull().any():
-    print(f"Warning: {df['aqi'].isnull().sum()} NaNs detected in 'aqi' column. Filling with 0.")
-    df['aqi'] = df['aqi'].ffill()
-
-df['aqi'] = df['aqi'].astype("int64")
-print("'aqi' column successfully cast to int.")
-
-
-# --- Store in Feature Store ---
-feature_group = fs.get_or_create_feature_group(
-    name="karachi_air_quality_raw",
-    version=1,
-    primary_key=["timestamp"],
-    event_time="timestamp",
-    description="Raw air pollution data for Karachi from OpenWeather"
-)
-
-print("Inserting raw data into Feature Group: karachi_air_quality_raw...")
-feature_group.insert(df, write_options={"wait_for_job": True})
-print("Raw data insertion complete. 🚀")
\ No newline at end of file
+
+# The year is fetched as ~monthly windows in parallel; smaller windows come back faster
+CHUNK_SECONDS = 30 * 24 * 60 * 60
+
+# Raw responses of finished history windows, which never change, are kept here between runs.
+# Windows reaching into the last SETTLE_SECONDS may still be revised and are always fetched.
+HTTP_CACHE_DIR = Path(__file__).resolve().parent / ".http_cache"
+SETTLE_SECONDS = 24 * 60 * 60
+# A window is only cached if it has at least this share of its hourly records, so a transient
+# empty or partial answer is fetched again next run instead of becoming a permanent gap
+MIN_CACHE_COVERAGE = 0.9
+
+url = "http://api.openweathermap.org/data/2.5/air_pollution/history?lat={lat}&lon={lon}&start={start}&end={end}&appid={key}"
+
+components = ["co", "no", "no2", "o3", "so2", "pm2_5", "pm10", "nh3"]
+
+
+async def fetch_chunk(session, api_key, chunk_start, chunk_end):
+    """Return (status code, raw body bytes) for one history window."""
+    async with session.get(url.format(lat=lat, lon=lon, start=chunk_start, end=chunk_end, key=api_key)) as resp:
+        return resp.status, await resp.read()
+
+
+async def fetch_all(api_key, chunks):
+    # One pooled session for all windows; it asks for gzip/deflate and decompresses transparently
+    timeout = aiohttp.ClientTimeout(total=60)
+    async with aiohttp.ClientSession(timeout=timeout, headers={"Accept-Encoding": "gzip, deflate"}) as session:
+        return await asyncio.gather(*[fetch_chunk(session, api_key, s, e) for s, e in chunks])
+
+
+def window_cache_path(chunk_start, chunk_end):
+    return HTTP_CACHE_DIR / f"air_pollution_{lat}_{lon}_{chunk_start}_{chunk_end}.json"
+
+
+def fetch_history(api_key, start, end):
+    """Fetch the air pollution records between `start` and `end` (unix seconds), or None if a request fails.
+
+    Windows are aligned to multiples of CHUNK_SECONDS so past ones have the same bounds on every run;
+    complete, settled windows are served from HTTP_CACHE_DIR once they have been fetched.
+    """
+    first = start - start % CHUNK_SECONDS
+    chunks = [(s, min(s + CHUNK_SECONDS - 1, end)) for s in range(first, end, CHUNK_SECONDS)]
+    cacheable = {(s, e) for s, e in chunks if e == s + CHUNK_SECONDS - 1 and e < end - SETTLE_SECONDS}
+
+    responses = {}
+    for chunk in cacheable:
+        path = window_cache_path(*chunk)
+        if path.exists():
+            responses[chunk] = (200, path.read_bytes())
+    missing = [chunk for chunk in chunks if chunk not in responses]
+    print(f"Requesting {len(missing)} of {len(chunks)} windows ({len(responses)} cached) from URL: {url.format(lat=lat, lon=lon, start=start, end=end, key='***YOUR_API_KEY***')}") # Hide key in log
+    if missing:
+        responses.update(zip(missing, asyncio.run(fetch_all(api_key, missing))))
+
+    items = []
+    for chunk in chunks:
+        status, body = responses[chunk]
+        # -------------------- CRITICAL ERROR HANDLING --------------------
+        # Check if the request was successful (HTTP 200)
+        # If not, the response is NOT JSON and will cause the error you see.
+        if status != 200:
+            print(f"Error: API request failed with status code {status}")
+            print("This is NOT a JSON response. The server returned:")
+            print(f"Response text: {body.decode(errors='replace')}")
+            print("\nPlease check your OPENWEATHER_API_KEY in the .env file.")
+            return None
+        # -------------------- END ERROR HANDLING --------------------
+
+        # Now it's safe to try parsing the JSON
+        try:
+            data = json_loads(body)
+        except json.JSONDecodeError:
+            print("Error: The server returned a 200 OK status, but the response was NOT valid JSON.")
+            print(f"Response text: {body.decode(errors='replace')}")
+            return None
+
+        if "list" not in data:
+            print(f"Error: 'list' key not in API response. Response was: {data}")
+            return None
+
+        path = window_cache_path(*chunk)
+        complete = len(data["list"]) >= MIN_CACHE_COVERAGE * CHUNK_SECONDS / 3600
+        if chunk in cacheable and complete and not path.exists():
+            HTTP_CACHE_DIR.mkdir(exist_ok=True)
+            tmp = path.with_name(path.name + ".tmp")
+            tmp.write_bytes(body)
+            os.replace(tmp, path)
+
+        # The first aligned window starts before `start`; keep only the requested range
+        if chunk[0] < start:
+            items.extend(item for item in data["list"] if item["dt"] >= start)
+        else:
+            items.extend(data["list"])
+    return items
+
+
+def to_array(values, count):
+    """Collect numeric values straight into a float64 array, with missing (None) values as NaN."""
+    return np.fromiter((np.nan if v is None else v for v in values), dtype=np.float64, count=count)
+
+
+def build_frame(items):
+    """Build the raw frame, in timestamp order, from the API records."""
+    # Build the frame column by column from typed arrays instead of one dict per record
+    dts = np.fromiter((item["dt"] for item in items), dtype=np.int64, count=len(items))
+    columns = {
+        # One vectorised conversion of the unix seconds to naive UTC datetimes
+        "timestamp": pd.to_datetime(dts, unit="s", utc=True).tz_convert(None),
+        "aqi": to_array((item.get("main", {}).get("aqi") for item in items), len(items)),
+    }
+    for comp in components:
+        columns[comp] = to_array((item.get("components", {}).get(comp) for item in items), len(items))
+
+    # The to_array() outputs are private to this call, so copy=False lets the frame use them as-is
+    df = pd.DataFrame(columns, copy=False)
+    # The windows come back in request order, each already chronological, so the sort is usually skipped
+    if not df["timestamp"].is_monotonic_increasing:
+        df = df.sort_values("timestamp", kind="mergesort").reset_index(drop=True)
+    return df
+
+
+def upsert_to_hopsworks(df):
+    """Insert the raw frame into the karachi_air_quality_raw feature group."""
+    _, fs = get_feature_store()
+    feature_group = fs.get_or_create_feature_group(
+        name="karachi_air_quality_raw",
+        version=1,
+        primary_key=["timestamp"],
+        event_time="timestamp",
+        description="Raw air pollution data for Karachi from OpenWeather"
+    )
+
+    print("Inserting raw data into Feature Group: karachi_air_quality_raw...")
+    insert_in_chunks(feature_group, df)
+    print("Raw data insertion complete. 🚀")
+
+
+def main():
+    # --- Setup ---
+    load_dotenv()
+    api_key = os.getenv("OPENWEATHER_API_KEY")
+
+    # Check if API keys are loaded
+    if not api_key:
+        print("Error: OPENWEATHER_API_KEY not found. Please check your .env file.")
+        return
+    if not os.getenv("HOPSWORKS_API_KEY"):
+        print("Error: HOPSWORKS_API_KEY not found. Please check your .env file.")
+        return
+
+    end = int(time.time())
+    start = end - 365 * 24 * 60 * 60  # last 365 days
+
+    # --- Fetch Data ---
+    print("Fetching air quality data from OpenWeather API...")
+    items = fetch_history(api_key, start, end)
+    if items is None:
+        return
+
+    df = build_frame(items)
+    if df.empty:
+        print("No records fetched. Exiting.")
+        return
+
+    print(f"Fetched {len(df)} raw records.")
+
+    # --- Fix 'aqi' column type for Hopsworks ---
+    print("Fixing 'aqi' column type to match feature group schema...")
+    if df['aqi'].isnull().any():
+        print(f"Warning: {df['aqi'].isnull().sum()} NaNs detected in 'aqi' column. Filling with 0.")
+        df['aqi'] = df['aqi'].ffill()
+
+    df['aqi'] = df['aqi'].astype("int64")
+    print("'aqi' column successfully cast to int.")
+
+    # --- Store in Feature Store ---
+    upsert_to_hopsworks(df)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,52 +1,83 @@
 import os
 import requests
+import numpy as np
 import pandas as pd
 import hopsworks
-import time, datetime
+import time
 
-HOPSWORKS_API_KEY = os.getenv("HOPSWORKS_API_KEY")
-OPENWEATHER_API_KEY = os.getenv("OPENWEATHER_API_KEY")
+LAT, LON = 24.8607, 67.0011
 
-project = hopsworks.login(api_key_value=HOPSWORKS_API_KEY)
-fs = project.get_feature_store()
+# Output column -> (response section, key, dtype). Pollutants are always float64, even when
+# the API sends a whole number, so the feature group schema does not depend on the values.
+COLMAP = {
+    "aqi": ("main", "aqi", np.int64),
+    "co": ("components", "co", np.float64),
+    "no": ("components", "no", np.float64),
+    "no2": ("components", "no2", np.float64),
+    "o3": ("components", "o3", np.float64),
+    "so2": ("components", "so2", np.float64),
+    "pm2_5": ("components", "pm2_5", np.float64),
+    "pm10": ("components", "pm10", np.float64),
+    "nh3": ("components", "nh3", np.float64),
+}
 
-LAT, LON = 24.8607, 67.0011
 
-end = int(time.time())
-start = end - 60 * 60  # one hour ago
-
-url = f"http://api.openweathermap.org/data/2.5/air_pollution/history?lat={LAT}&lon={LON}&start={start}&end={end}&appid={OPENWEATHER_API_KEY}"
-
-res = requests.get(url)
-data = res.json()
-
-if "list" in data:
-    records = []
-    for item in data["list"]:
-        records.append({
-            "timestamp": datetime.datetime.utcfromtimestamp(item["dt"]),
-            "aqi": item["main"]["aqi"],
-            "co": item["components"]["co"],
-            "no": item["components"]["no"],
-            "no2": item["components"]["no2"],
-            "o3": item["components"]["o3"],
-            "so2": item["components"]["so2"],
-            "pm2_5": item["components"]["pm2_5"],
-            "pm10": item["components"]["pm10"],
-            "nh3": item["components"]["nh3"]
-        })
-
-    df = pd.DataFrame(records)
+def to_array(values, dtype, count):
+    """Collect values straight into a typed array; in float columns missing (None) values become NaN."""
+    # Same None -> NaN rule as raw_ingestion.to_array(); this script runs on its own, so it keeps a copy
+    if np.issubdtype(dtype, np.floating):
+        values = (np.nan if v is None else v for v in values)
+    return np.fromiter(values, dtype=dtype, count=count)
+
+
+def fetch_air_quality(start, end):
+    """Fetch the OpenWeather air pollution history for [start, end] (unix seconds) as a DataFrame, or None."""
+    url = f"http://api.openweathermap.org/data/2.5/air_pollution/history?lat={LAT}&lon={LON}&start={start}&end={end}&appid={os.getenv('OPENWEATHER_API_KEY')}"
+
+    res = requests.get(url, timeout=30)
+    data = res.json()
+
+    if "list" not in data:
+        print(" API returned no valid data:", data)
+        return None
+
+    items = data["list"]
+    # Build each column straight into a typed array instead of one dict per record
+    dts = np.fromiter((item["dt"] for item in items), dtype=np.int64, count=len(items))
+    columns = {"timestamp": pd.to_datetime(dts, unit="s")}
+    for col, (section, key, dtype) in COLMAP.items():
+        columns[col] = to_array((item[section][key] for item in items), dtype, len(items))
+
+    # No copy: nothing else holds these columns once the function returns
+    return pd.DataFrame(columns, copy=False)
+
+
+def upsert_to_hopsworks(df):
+    """Insert the rows into the karachi_air_quality feature group."""
+    project = hopsworks.login(api_key_value=os.getenv("HOPSWORKS_API_KEY"))
+    fs = project.get_feature_store()
+    feature_group = fs.get_or_create_feature_group(
+        name="karachi_air_quality",
+        version=1,
+        primary_key=["timestamp"],
+        description="Hourly air pollution data for Karachi from OpenWeather API"
+    )
+    feature_group.insert(df)
+    print(" Data inserted successfully")
+
+
+def main():
+    end = int(time.time())
+    start = end - 60 * 60  # one hour ago
+
+    df = fetch_air_quality(start, end)
+    if df is None:
+        return
     if not df.empty:
-        feature_group = fs.get_or_create_feature_group(
-            name="karachi_air_quality",
-            version=1,
-            primary_key=["timestamp"],
-            description="Hourly air pollution data for Karachi from OpenWeather API"
-        )
-        feature_group.insert(df)
-        print(" Data inserted successfully")
+        upsert_to_hopsworks(df)
     else:
         print(" No data found for this hour.")
-else:
-    print(" API returned no valid data:", data)
+
+
+if __name__ == "__main__":
+    main()
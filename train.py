@@ -1,85 +1,189 @@
+import gc
+import hashlib
 import json
 import os
 from pathlib import Path
+import numpy as np
 import pandas as pd
+import pyarrow.parquet as pq
 from sklearn.model_selection import train_test_split
-from sklearn.ensemble import RandomForestRegressor
-from sklearn.metrics import mean_absolute_error
+from sklearn.ensemble import HistGradientBoostingRegressor
+from sklearn.metrics import mean_absolute_error, r2_score
+from sklearn.inspection import permutation_importance
 import joblib
+from feature_store_utils import get_feature_store, get_latest_feature_group, project_columns, read_feature_group_cached, read_recent_cache
 
+# A cached Feature Store read younger than this (seconds) is used without logging in to Hopsworks
+FS_CACHE_TTL = int(os.getenv("FS_CACHE_TTL", "3600"))
 
-def load_features_from_feature_store():
+# If set, train on a uniform random sample of at most this many rows (0 disables sampling)
+TRAIN_MAX_ROWS = int(os.getenv("TRAIN_MAX_ROWS", "0"))
+
+
+def load_features_from_feature_store(columns=None):
 	"""Try to load features from Hopsworks. If hopsworks isn't available, raise an exception."""
 	try:
-		import hopsworks
-		project = hopsworks.login()
-		fs = project.get_feature_store()
-		# Try both versions (2 then 1) to be resilient to feature group version changes
-		for v in (2, 1):
-			try:
-				fg = fs.get_feature_group("karachi_air_quality_features", version=v)
-				print(f"Loaded feature group 'karachi_air_quality_features' version {v} from Feature Store.")
-				return fg.read()
-			except Exception:
-				continue
-		raise RuntimeError("Could not find 'karachi_air_quality_features' in the Feature Store (versions tried: 2,1).")
+		project, fs = get_feature_store()
+		# Pick the newest version (falls back to probing 2 then 1) to be resilient to feature group version changes
+		fg = get_latest_feature_group(fs, "karachi_air_quality_features")
+		if fg is None:
+			raise RuntimeError("Could not find 'karachi_air_quality_features' in the Feature Store (versions tried: 2,1).")
+		print(f"Loaded feature group 'karachi_air_quality_features' version {fg.version} from Feature Store.")
+		return read_feature_group_cached(fg, columns)
 	except Exception as e:
 		raise
 
 
-def load_features_df():
-	"""Load features dataframe from Feature Store if possible, otherwise fallback to local CSV `features_data.csv`."""
+def load_features_df(columns=None):
+	"""Load features dataframe from Feature Store if possible, otherwise fallback to local `features_data.parquet` / `features_data.csv`.
+
+	If `columns` is given, only those columns are read (missing ones are ignored) on every path.
+	"""
+	# A recently checked local copy of the feature group skips the Hopsworks round-trip entirely
+	df = read_recent_cache("karachi_air_quality_features", FS_CACHE_TTL, columns)
+	if df is not None:
+		return df
 	# First try feature store
 	try:
-		df = load_features_from_feature_store()
+		df = load_features_from_feature_store(columns)
 		return df
 	except Exception as e:
-		print(f"Warning: could not load from Feature Store ({e}). Falling back to local 'features_data.csv'.")
-		local_path = Path(__file__).parent / "features_data.csv"
-		# If not next to this file, try repo root
-		if not local_path.exists():
-			local_path = Path.cwd() / "features_data.csv"
-		if not local_path.exists():
-			raise FileNotFoundError("features_data.csv not found locally. Please run feature engineering or provide data.")
-		df = pd.read_csv(local_path)
+		print(f"Warning: could not load from Feature Store ({e}). Falling back to local 'features_data.parquet' / 'features_data.csv'.")
+		# Prefer the Parquet copy from a previous run; the CSV is kept for backward compatibility.
+		# Look next to this file first, then in the repo root.
+		candidates = [base / name for name in ("features_data.parquet", "features_data.csv") for base in (Path(__file__).parent, Path.cwd())]
+		local_path = next((p for p in candidates if p.exists()), None)
+		if local_path is None:
+			raise FileNotFoundError("features_data.parquet / features_data.csv not found locally. Please run feature engineering or provide data.")
+		if local_path.suffix == ".parquet":
+			present = project_columns(columns, pq.read_schema(local_path).names)
+			df = pd.read_parquet(local_path, engine="pyarrow", columns=present)
+		else:
+			wanted = None if columns is None else set(columns)
+			df = pd.read_csv(local_path, usecols=None if wanted is None else (lambda c: c in wanted))
 		print(f"Loaded features from {local_path}.")
 		return df
 
 
+def save_features_copy(df, path="features_data.parquet"):
+	"""Write the local features copy for the apps, skipping the write if the data has not changed since the last one."""
+	# Content hash of the values and column names, stored next to the file
+	digest = hashlib.sha256(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+	digest.update(",".join(map(str, df.columns)).encode())
+	digest = digest.hexdigest()
+	sidecar = Path(f"{path}.sha")
+	if Path(path).exists() and sidecar.exists() and sidecar.read_text() == digest:
+		print(f"'{path}' is unchanged, not rewriting it.")
+		return
+	# Parquet keeps dtypes and needs no text parsing
+	df.to_parquet(path, engine="pyarrow", compression="zstd", index=False)
+	sidecar.write_text(digest)
+
+
+def write_text_if_changed(path, text):
+	"""Atomically write `text` to `path`, leaving the file (and its mtime) alone if it already holds `text`."""
+	path = Path(path)
+	try:
+		if path.read_text() == text:
+			return False
+	except FileNotFoundError:
+		pass
+	tmp = path.with_name(path.name + ".tmp")
+	tmp.write_text(text)
+	os.replace(tmp, path)
+	return True
+
+
+def save_model(model, path="model.pkl"):
+	"""Dump the model next to `path` and swap it in atomically, unless it is byte-identical to the current one.
+
+	The sha256 of the dump is kept in a `.sha` sidecar so an unchanged model is detected without re-reading the file.
+	"""
+	path = Path(path)
+	tmp = path.with_name(path.name + ".tmp")
+	# Uncompressed so the API can memory-map the arrays (compression rules out mmap_mode);
+	# pickle protocol 5 writes large buffers without extra copies
+	joblib.dump(model, tmp, compress=0, protocol=5)
+	digest = hashlib.sha256()
+	with open(tmp, "rb") as f:
+		for block in iter(lambda: f.read(1 << 20), b""):
+			digest.update(block)
+	digest = digest.hexdigest()
+	sidecar = Path(f"{path}.sha")
+	if path.exists() and sidecar.exists() and sidecar.read_text() == digest:
+		tmp.unlink()
+		return False
+	os.replace(tmp, path)
+	sidecar.write_text(digest)
+	return True
+
+
 def main():
-	df = load_features_df()
+	# Optionally read only the columns the current model was trained on (plus target and timestamp),
+	# pushing the projection into the read. Off by default: with it on, newly engineered features
+	# never reach training until feature_columns.json is regenerated without it.
+	columns = None
+	if os.getenv("TRAIN_USE_SAVED_FEATURE_COLUMNS") == "1" and Path("feature_columns.json").exists():
+		with open("feature_columns.json", "r") as f:
+			columns = json.load(f) + ["aqi", "timestamp"]
+
+	df = load_features_df(columns)
 
 	# Save a copy locally so other apps can use it
-	df.to_csv("features_data.csv", index=False)
+	save_features_copy(df)
 
 	# Prepare data
 	if "aqi" not in df.columns:
 		raise RuntimeError("Input data must contain 'aqi' column as target.")
 
+	# Subsampled fit: much faster once the table grows large, at the cost of a small accuracy drop
+	if TRAIN_MAX_ROWS and len(df) > TRAIN_MAX_ROWS:
+		print(f"Training on a random sample of {TRAIN_MAX_ROWS} of {len(df)} rows (TRAIN_MAX_ROWS); expect slightly lower accuracy for a faster fit.")
+		df = df.sample(n=TRAIN_MAX_ROWS, random_state=42)
+
 	X = df.drop(columns=[c for c in ("aqi", "timestamp") if c in df.columns])
 	y = df["aqi"]
 
 	# Remember the feature column order so the API and frontends can reconstruct inputs
 	feature_columns = X.columns.tolist()
 
-	# Save feature column list
-	with open("feature_columns.json", "w") as f:
-		json.dump(feature_columns, f)
+	# Save feature column list, only touching the file when the list changes so watchers and caches keyed on it stay valid
+	write_text_if_changed("feature_columns.json", json.dumps(feature_columns))
+
+	# Convert once to float32, integer columns included. NaNs are left in place: the
+	# histogram model bins missing values natively, so no filled copy is needed.
+	X_arr = X.to_numpy(dtype=np.float32)
 
 	# Train/test split and model
-	X_train, X_test, y_train, y_test = train_test_split(X.fillna(0), y, test_size=0.2, random_state=42)
-	model = RandomForestRegressor(n_estimators=100, random_state=42)
+	X_train, X_test, y_train, y_test = train_test_split(X_arr, y, test_size=0.2, random_state=42)
+	# The split holds its own copies; drop the full frame and arrays so they are not kept alive through the fit
+	del df, X, y, X_arr
+	gc.collect()
+	# Features are binned into 255 histogram buckets once, so each split is evaluated over bins instead of
+	# sorted samples; fitting and prediction use all cores through OpenMP
+	model = HistGradientBoostingRegressor(max_iter=200, learning_rate=0.05, max_bins=255, early_stopping=True, random_state=42)
 	model.fit(X_train, y_train)
 
 	# Save model
-	joblib.dump(model, "model.pkl")
-	print("Saved trained model to 'model.pkl'.")
+	model_changed = save_model(model, "model.pkl")
+	if model_changed:
+		print("Saved trained model to 'model.pkl'.")
+	else:
+		print("Trained model is identical to 'model.pkl', not rewriting it.")
 
-	# Metrics
+	# Metrics: one predict per split; model.score() would predict again for each R² it reports
 	y_pred = model.predict(X_test)
+	y_pred_train = model.predict(X_train)
 	print("MAE:", mean_absolute_error(y_test, y_pred))
-	print("accuracy:", model.score(X_test, y_test))
-	print("training accuracy:", model.score(X_train, y_train))
+	print("accuracy:", r2_score(y_test, y_pred))
+	print("training accuracy:", r2_score(y_train, y_pred_train))
+
+	# HistGradientBoostingRegressor has no feature_importances_, so save permutation importances
+	# on the held-out split for the dashboard (mean drop in R² when a feature is shuffled).
+	# They are deterministic, so an unchanged model keeps the importances saved with it.
+	if model_changed or not Path("feature_importances.json").exists():
+		importances = permutation_importance(model, X_test, y_test, n_repeats=3, random_state=42, max_samples=min(len(X_test), 5000))
+		write_text_if_changed("feature_importances.json", json.dumps(dict(zip(feature_columns, importances.importances_mean.tolist()))))
 
 
 if __name__ == "__main__":